@@ -6,6 +6,12 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import io
+import json
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import defaultdict
 
 # Configuration de la page
 st.set_page_config(
@@ -29,12 +35,380 @@ if 'chirurgiens' not in st.session_state:
 if 'jours' not in st.session_state:
     st.session_state.jours = []
 if 'compatibilite' not in st.session_state:
-    st.session_state.compatibilite = {}
+    # Matrice int8 patients x chirurgiens, indexée par identifiants
+    st.session_state.compatibilite = pd.DataFrame(dtype=np.int8)
 if 'planning_result' not in st.session_state:
     st.session_state.planning_result = None
 if 'model_status' not in st.session_state:
     st.session_state.model_status = None
 
+# Ensembles d'identifiants tenus à jour avec chaque liste : test d'unicité
+# en O(1) à l'ajout. Reconstruits dès que la liste est remplacée (import,
+# suppression, réinitialisation), repérée par l'id() de la liste source
+for cle in ('patients', 'salles', 'chirurgiens'):
+    liste = st.session_state[cle]
+    if (st.session_state.get(f'_ids_source_{cle}') != id(liste)
+            or len(st.session_state[f'_ids_{cle}']) != len(liste)):
+        st.session_state[f'_ids_{cle}'] = {e['id'] for e in liste}
+        st.session_state[f'_ids_source_{cle}'] = id(liste)
+
+def ajouter_element(cle, element):
+    """Ajoute un patient, une salle ou un chirurgien et son identifiant."""
+    st.session_state[cle].append(element)
+    st.session_state[f'_ids_{cle}'].add(element['id'])
+
+# Options CBC : graine fixe (résultats reproductibles), arrêt à 1 % de
+# l'optimum, prétraitement, heuristiques (dont feasibility pump) et coupes,
+# en particulier sac à dos et Gomory, adaptées aux contraintes de capacité
+OPTIONS_CBC = ['randomCbcSeed 1', 'ratio 0.01', 'preprocess on', 'heur on', 'feas on',
+               'cuts on', 'knapsack on', 'gomory on']
+
+@st.cache_resource(show_spinner=False)
+def solveur_cbc():
+    """
+    Instance PULP_CBC_CMD créée une seule fois par processus : le binaire
+    CBC est localisé et vérifié au premier appel. None si indisponible.
+    """
+    cbc = pulp.PULP_CBC_CMD(msg=False)
+    return cbc if cbc.available() else None
+
+@st.cache_resource(show_spinner=False)
+def cbc_multithread():
+    """
+    Sonde une seule fois le binaire CBC : certaines roues PuLP sont compilées
+    sans support des threads (installer alors `conda install coincbc`).
+    Retourne False si l'option -threads n'est pas reconnue.
+    """
+    cbc = solveur_cbc()
+    if cbc is None:
+        return False
+    try:
+        sortie = subprocess.run([cbc.path, '-threads', '2', '-quit'],
+                                capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return 'threads was changed' in sortie
+
+def solveur_secours(time_limit):
+    """
+    Solveur du modèle PuLP de secours : CBC (options et threads ci-dessus,
+    démarrage à chaud) s'il est disponible, sinon HiGHS ou, à défaut, le
+    premier solveur MILP disponible pour PuLP. None si aucun ne l'est.
+    """
+    if solveur_cbc() is not None:
+        return pulp.PULP_CBC_CMD(
+            msg=False,
+            timeLimit=time_limit,
+            threads=os.cpu_count() if cbc_multithread() else None,
+            options=OPTIONS_CBC,
+            warmStart=True
+        )
+    disponibles = pulp.listSolvers(onlyAvailable=True)
+    for nom in ['HiGHS', 'HiGHS_CMD', *disponibles]:
+        if nom in disponibles:
+            return pulp.getSolver(nom, msg=False, timeLimit=time_limit)
+    return None
+
+# Portefeuille CBC : réglages lancés en parallèle sur les grandes instances
+# (au-delà de SEUIL_PORTEFEUILLE variables x), le premier terminé l'emporte
+SEUIL_PORTEFEUILLE = 2000
+PORTEFEUILLE_CBC = [
+    OPTIONS_CBC,
+    ['randomCbcSeed 7', 'ratio 0.01', 'preprocess sos', 'heur on', 'cuts root', 'knapsack on'],
+    ['randomCbcSeed 13', 'ratio 0.01', 'preprocess off', 'heur on', 'cuts on', 'gomory on'],
+    ['randomCbcSeed 42', 'ratio 0.01', 'preprocess on', 'heur off', 'cuts ifmove'],
+]
+
+def affectation_gloutonne_lpt(I, J, S, K, t, b, a, compat_is):
+    """
+    Heuristique LPT : patients par durée décroissante, chacun placé dans le
+    couple (salle, jour) le moins chargé où il tient, avec le chirurgien
+    compatible le plus disponible ce jour-là. Retourne {i: (j, k, s)}.
+    """
+    reste_salle = dict(b)
+    reste_chir = dict(a)
+    affectation = {}
+    for i in sorted(I, key=t.__getitem__, reverse=True):
+        duree = t[i]
+        meilleur = None
+        for j in J:
+            for k in K:
+                if reste_salle[(j, k)] < duree:
+                    continue
+                for s in compat_is[i]:
+                    if reste_chir[(s, k)] < duree:
+                        continue
+                    score = (reste_salle[(j, k)], reste_chir[(s, k)])
+                    if meilleur is None or score > meilleur[0]:
+                        meilleur = (score, j, k, s)
+        if meilleur is not None:
+            _, j, k, s = meilleur
+            reste_salle[(j, k)] -= duree
+            reste_chir[(s, k)] -= duree
+            affectation[i] = (j, k, s)
+    return affectation
+
+def groupes_symetriques(I, J, S, K, b, a, compat_is):
+    """
+    Ressources interchangeables : salles de même capacité chaque jour, et
+    chirurgiens de même disponibilité compatibles avec les mêmes patients.
+    Retourne (groupes de salles, groupes de chirurgiens), chaque groupe
+    (au moins deux membres) dans l'ordre d'origine.
+    """
+    patients_par_chirurgien = defaultdict(list)
+    for i in I:
+        for s in compat_is[i]:
+            patients_par_chirurgien[s].append(i)
+    salles = defaultdict(list)
+    for j in J:
+        salles[tuple(b[(j, k)] for k in K)].append(j)
+    chirurgiens = defaultdict(list)
+    for s in S:
+        chirurgiens[(tuple(a[(s, k)] for k in K), tuple(patients_par_chirurgien[s]))].append(s)
+    return ([g for g in salles.values() if len(g) > 1],
+            [g for g in chirurgiens.values() if len(g) > 1])
+
+def paires_symetriques(groupes, K):
+    """
+    Contraintes de symétrie (ordre lexicographique) : pour deux membres
+    consécutifs r1, r2 d'un groupe, charge(r1, k) >= charge(r2, k) chaque
+    jour. Retourne les triplets (r1, r2, k).
+    """
+    return [(r1, r2, k) for groupe in groupes for r1, r2 in zip(groupe, groupe[1:]) for k in K]
+
+def ordonner_depart(affectation, t, K, groupes_salles, groupes_chirurgiens):
+    """
+    Renumérote, dans chaque groupe symétrique et chaque jour, salles et
+    chirurgiens par charge décroissante : la solution de départ {i: (j, k, s)}
+    reste réalisable et respecte les contraintes de symétrie.
+    """
+    charge_salle = defaultdict(int)
+    charge_chir = defaultdict(int)
+    for i, (j, k, s) in affectation.items():
+        charge_salle[(j, k)] += t[i]
+        charge_chir[(s, k)] += t[i]
+    
+    def renommage(groupes, charge):
+        nouveau = {}
+        for groupe in groupes:
+            for k in K:
+                tri = sorted(groupe, key=lambda r: -charge[(r, k)])
+                nouveau.update({(r, k): cible for r, cible in zip(tri, groupe)})
+        return nouveau
+    
+    salle = renommage(groupes_salles, charge_salle)
+    chir = renommage(groupes_chirurgiens, charge_chir)
+    return {i: (salle.get((j, k), j), k, chir.get((s, k), s)) for i, (j, k, s) in affectation.items()}
+
+def executer_cbc(chemin_mps, dossier, time_limit, portefeuille=False, depart=None):
+    """
+    Lance CBC sur un fichier MPS : un seul processus multithread, ou, avec
+    `portefeuille`, un CBC monothread par réglage de PORTEFEUILLE_CBC dont
+    on garde le premier qui aboutit (les autres sont arrêtés). `depart` :
+    fichier solution initiale (démarrage à chaud -mips), optionnel.
+    Retourne le chemin du fichier solution, ou None si aucun n'a abouti.
+    """
+    cbc = solveur_cbc().path
+    if portefeuille:
+        configurations = [(options, None) for options in PORTEFEUILLE_CBC]
+    else:
+        configurations = [(OPTIONS_CBC, os.cpu_count() if cbc_multithread() else None)]
+    
+    processus = {}
+    for n, (options, threads) in enumerate(configurations):
+        chemin_sol = os.path.join(dossier, f'solution_{n}.txt')
+        args = [cbc, chemin_mps]
+        if depart:
+            args += ['-mips', depart]
+        args += ['-sec', str(time_limit)]
+        if threads:
+            args += ['-threads', str(threads)]
+        for option in options:
+            args += ('-' + option).split()
+        args += ['-solve', '-solution', chemin_sol]
+        processus[chemin_sol] = subprocess.Popen(args, stdout=subprocess.DEVNULL,
+                                                 stderr=subprocess.DEVNULL)
+    
+    gagnant = None
+    with ThreadPoolExecutor(len(processus)) as pool:
+        try:
+            attentes = {pool.submit(p.wait): chemin for chemin, p in processus.items()}
+            en_cours = set(attentes)
+            while en_cours and gagnant is None:
+                termines, en_cours = wait(en_cours, return_when=FIRST_COMPLETED)
+                for f in termines:
+                    if f.result() == 0 and os.path.exists(attentes[f]):
+                        gagnant = attentes[f]
+                        break
+        finally:
+            for p in processus.values():
+                if p.poll() is None:
+                    p.kill()
+    return gagnant
+
+def ecrire_mps(chemin, I, J, S, K, t, b, a, compat_is):
+    """
+    Écrit le modèle (minimisation du temps libre, sans la constante sum(b))
+    directement au format MPS libre, sans objets PuLP : colonnes C<n>,
+    lignes R<n>. Retourne les numéros de colonne des x {(i, j, k): n} et
+    des z {(i, s, k): n}.
+    """
+    rows = [' N  OBJ']
+    rhs = []
+    
+    def ligne(sens, second_membre):
+        nom = f'R{len(rows) - 1}'
+        rows.append(f' {sens}  {nom}')
+        if second_membre:
+            rhs.append(f'    RHS  {nom}  {second_membre}')
+        return nom
+    
+    r_once = {i: ligne('L', 1) for i in I}
+    r_salle = {(j, k): ligne('L', b[(j, k)]) for j in J for k in K}
+    r_chir = {(s, k): ligne('L', a[(s, k)]) for s in S for k in K}
+    r_lien = {(i, k): ligne('E', 0) for i in I for k in K}
+    
+    # Bris de symétrie : lignes G charge(r1, k) - charge(r2, k) >= 0, et pour
+    # chaque (ressource, jour) la liste des (ligne, signe) où elle apparaît
+    groupes_salles, groupes_chirurgiens = groupes_symetriques(I, J, S, K, b, a, compat_is)
+    sym_salle = defaultdict(list)
+    sym_chir = defaultdict(list)
+    for sym, groupes in ((sym_salle, groupes_salles), (sym_chir, groupes_chirurgiens)):
+        for r1, r2, k in paires_symetriques(groupes, K):
+            nom = ligne('G', 0)
+            sym[(r1, k)].append((nom, 1))
+            sym[(r2, k)].append((nom, -1))
+    
+    # Colonnes x (objectif, Once, ORcap, lien) puis z (SurgeonCap, lien),
+    # au plus deux coefficients par ligne MPS
+    colonnes = ["    MARKER  'MARKER'  'INTORG'"]
+    bornes = []
+    colonnes_x = {}
+    colonnes_z = {}
+    for i in I:
+        for k in K:
+            for j in J:
+                colonnes_x[(i, j, k)] = len(bornes)
+                c = f'C{len(bornes)}'
+                colonnes.append(f'    {c}  OBJ  {-t[i]}  {r_once[i]}  1')
+                colonnes.append(f'    {c}  {r_salle[(j, k)]}  {t[i]}  {r_lien[(i, k)]}  -1')
+                colonnes.extend(f'    {c}  {nom}  {signe * t[i]}' for nom, signe in sym_salle[(j, k)])
+                bornes.append(f' BV BND  {c}')
+            for s in compat_is[i]:
+                colonnes_z[(i, s, k)] = len(bornes)
+                c = f'C{len(bornes)}'
+                colonnes.append(f'    {c}  {r_chir[(s, k)]}  {t[i]}  {r_lien[(i, k)]}  1')
+                colonnes.extend(f'    {c}  {nom}  {signe * t[i]}' for nom, signe in sym_chir[(s, k)])
+                bornes.append(f' BV BND  {c}')
+    colonnes.append("    MARKER  'MARKER'  'INTEND'")
+    
+    with open(chemin, 'w') as f:
+        f.write('\n'.join(['NAME  ORS_idle_min', 'ROWS', *rows, 'COLUMNS', *colonnes,
+                           'RHS', *rhs, 'BOUNDS', *bornes, 'ENDATA', '']))
+    return colonnes_x, colonnes_z
+
+def ecrire_depart(chemin, n_colonnes, colonnes_x, colonnes_z, affectation):
+    """
+    Écrit la solution initiale {i: (j, k, s)} au format solution CBC
+    (lu par -mips) : une ligne par colonne, 1 pour les x/z retenus.
+    """
+    valeurs = [0] * n_colonnes
+    for i, (j, k, s) in affectation.items():
+        valeurs[colonnes_x[(i, j, k)]] = 1
+        valeurs[colonnes_z[(i, s, k)]] = 1
+    with open(chemin, 'w') as f:
+        f.write('\n'.join(['Stopped on time - objective value 0',
+                           *(f'{n} C{n} {v} 0' for n, v in enumerate(valeurs)), '']))
+
+def assembler_affectations(x_actifs, z_actifs):
+    """
+    Affectations {i: (j, k, [chirurgiens])} à partir des x[i, j, k] et
+    z[i, s, k] à 1 : la salle est l'unique j retenu pour le jour k du patient.
+    """
+    chirurgiens = defaultdict(list)
+    for i, s, k in z_actifs:
+        chirurgiens[(i, k)].append(s)
+    return {i: (j, k, chirurgiens[(i, k)]) for i, j, k in x_actifs}
+
+def resoudre_mps_direct(I, J, S, K, t, b, a, compat_is, time_limit):
+    """
+    Résout le modèle via ecrire_mps + binaire CBC (portefeuille sur les
+    grandes instances), démarré à chaud sur la solution LPT. Retourne
+    (statut, affectations) ; modèle vide (aucun patient planifiable) :
+    ('Optimal', {}) sans appel au solveur. None si CBC est indisponible ou
+    n'a pas abouti : l'appelant repasse alors par PuLP (solveur_secours).
+    """
+    if not I:
+        return 'Optimal', {}
+    cbc = solveur_cbc()
+    if cbc is None:
+        return None
+    portefeuille = len(I) * len(J) * len(K) > SEUIL_PORTEFEUILLE and (os.cpu_count() or 1) > 1
+    with tempfile.TemporaryDirectory() as dossier:
+        chemin_mps = os.path.join(dossier, 'modele.mps')
+        colonnes_x, colonnes_z = ecrire_mps(chemin_mps, I, J, S, K, t, b, a, compat_is)
+        cles_x = {f'C{n}': cle for cle, n in colonnes_x.items()}
+        cles_z = {f'C{n}': cle for cle, n in colonnes_z.items()}
+        
+        # Démarrage à chaud : solution LPT gloutonne comme premier incumbent
+        chemin_depart = os.path.join(dossier, 'depart.txt')
+        depart = ordonner_depart(affectation_gloutonne_lpt(I, J, S, K, t, b, a, compat_is), t, K,
+                                 *groupes_symetriques(I, J, S, K, b, a, compat_is))
+        ecrire_depart(chemin_depart, len(cles_x) + len(cles_z), colonnes_x, colonnes_z, depart)
+        chemin_sol = executer_cbc(chemin_mps, dossier, time_limit, portefeuille, chemin_depart)
+        if chemin_sol is None:
+            return None
+        status, _ = cbc.get_status(chemin_sol)
+        # Fichier solution CBC : seules les colonnes non nulles sont listées
+        x_actifs, z_actifs = [], []
+        with open(chemin_sol) as f:
+            next(f, None)
+            for ligne in f:
+                champs = ligne.split()
+                if champs[:1] == ['**']:
+                    champs = champs[1:]
+                if len(champs) < 3 or float(champs[2]) <= 0.5:
+                    continue
+                if champs[1] in cles_x:
+                    x_actifs.append(cles_x[champs[1]])
+                elif champs[1] in cles_z:
+                    z_actifs.append(cles_z[champs[1]])
+    return pulp.LpStatus[status], assembler_affectations(x_actifs, z_actifs)
+
+@st.cache_data(show_spinner=False)
+def construire_df_compat(patients_cles, chirurgiens_ids, compatibilite):
+    """
+    Tableau de compatibilité affiché : une ligne par patient, une colonne par
+    chirurgien, compatible par défaut. Colonnes booléennes (cases à cocher,
+    charge Arrow réduite). Mis en cache : il n'est reconstruit que si
+    patients, chirurgiens ou saisies changent.
+    """
+    df_compat = compatibilite.reindex(
+        index=[pid for pid, _, _ in patients_cles], columns=list(chirurgiens_ids), fill_value=1
+    ).astype(bool).reset_index(drop=True)
+    df_compat.insert(0, 'Patient', [f"{pid} - {nom} {prenom}" for pid, nom, prenom in patients_cles])
+    return df_compat
+
+@st.cache_data(show_spinner=False)
+def exporter_csv(details):
+    """Planning détaillé au format CSV, sérialisé une fois par optimisation."""
+    return pd.DataFrame(details).to_csv(index=False).encode('utf-8')
+
+@st.cache_data(show_spinner=False)
+def exporter_excel(details, stats):
+    """Classeur Excel (planning + statistiques), sérialisé une fois par optimisation."""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        pd.DataFrame(details).to_excel(writer, sheet_name='Planning', index=False)
+        if stats is not None:
+            pd.DataFrame(stats).to_excel(writer, sheet_name='Statistiques', index=False)
+    return output.getvalue()
+
+@st.cache_data(show_spinner=False)
+def exporter_json(result):
+    """Résultat complet en JSON, sérialisé une fois par optimisation."""
+    return json.dumps(result, indent=2, default=str).encode('utf-8')
+
 # Sidebar pour la navigation
 with st.sidebar:
     st.image("https://cdn-icons-png.flaticon.com/512/3050/3050525.png", width=100)
@@ -64,7 +438,7 @@ with st.sidebar:
     
     if st.button("🗑️ Réinitialiser toutes les données"):
         for key in ['patients', 'salles', 'chirurgiens', 'jours', 'compatibilite', 'planning_result']:
-            st.session_state[key] = [] if key != 'compatibilite' else {}
+            st.session_state[key] = [] if key != 'compatibilite' else pd.DataFrame(dtype=np.int8)
         st.rerun()
 
 # =====================================================================
@@ -167,12 +541,11 @@ elif page == "👥 Gestion Patients":
                     'notes': notes
                 }
                 
-                # Vérifier si l'ID existe déjà
-                ids_existants = [p['id'] for p in st.session_state.patients]
-                if patient_id in ids_existants:
+                # Vérifier si l'ID existe déjà (ensemble d'identifiants, O(1))
+                if patient_id in st.session_state._ids_patients:
                     st.error(f"L'ID {patient_id} existe déjà!")
                 else:
-                    st.session_state.patients.append(nouveau_patient)
+                    ajouter_element('patients', nouveau_patient)
                     st.success(f"Patient {prenom} {nom} ajouté avec succès!")
                     st.rerun()
             else:
@@ -247,11 +620,11 @@ elif page == "🚪 Gestion Salles":
                     'equipements': equipements
                 }
                 
-                ids_existants = [s['id'] for s in st.session_state.salles]
-                if salle_id in ids_existants:
+                # Vérifier si l'ID existe déjà (ensemble d'identifiants, O(1))
+                if salle_id in st.session_state._ids_salles:
                     st.error(f"L'ID {salle_id} existe déjà!")
                 else:
-                    st.session_state.salles.append(nouvelle_salle)
+                    ajouter_element('salles', nouvelle_salle)
                     st.success(f"Salle {nom_salle} ajoutée!")
                     st.rerun()
             else:
@@ -326,11 +699,11 @@ elif page == "👨‍⚕️ Gestion Chirurgiens":
                     'matricule': matricule
                 }
                 
-                ids_existants = [c['id'] for c in st.session_state.chirurgiens]
-                if chirurgien_id in ids_existants:
+                # Vérifier si l'ID existe déjà (ensemble d'identifiants, O(1))
+                if chirurgien_id in st.session_state._ids_chirurgiens:
                     st.error(f"L'ID {chirurgien_id} existe déjà!")
                 else:
-                    st.session_state.chirurgiens.append(nouveau_chir)
+                    ajouter_element('chirurgiens', nouveau_chir)
                     st.success(f"Chirurgien {prenom_chir} {nom_chir} ajouté!")
                     st.rerun()
             else:
@@ -374,16 +747,15 @@ elif page == "📅 Configuration Jours":
         )
         
         if st.button("📅 Générer les jours", type="primary"):
-            st.session_state.jours = []
-            for i in range(nb_jours):
-                jour_date = date_debut + timedelta(days=i)
-                jour_info = {
+            st.session_state.jours = [
+                {
                     'numero': i + 1,
-                    'date': jour_date.strftime("%Y-%m-%d"),
-                    'jour_semaine': jour_date.strftime("%A"),
-                    'label': f"Jour {i+1} ({jour_date.strftime('%d/%m/%Y')})"
+                    'date': f"{jour_date:%Y-%m-%d}",
+                    'jour_semaine': f"{jour_date:%A}",
+                    'label': f"Jour {i+1} ({jour_date:%d/%m/%Y})"
                 }
-                st.session_state.jours.append(jour_info)
+                for i, jour_date in enumerate(date_debut + timedelta(days=n) for n in range(nb_jours))
+            ]
             st.success(f"{nb_jours} jours générés à partir du {date_debut.strftime('%d/%m/%Y')}")
             st.rerun()
     
@@ -407,7 +779,7 @@ elif page == "⚙️ Compatibilité":
     else:
         # Initialiser la matrice de compatibilité
         if 'compatibilite' not in st.session_state:
-            st.session_state.compatibilite = {}
+            st.session_state.compatibilite = pd.DataFrame(dtype=np.int8)
         
         # Créer un tableau de compatibilité
         st.subheader("Matrice de compatibilité")
@@ -416,18 +788,12 @@ elif page == "⚙️ Compatibilité":
         patients_list = st.session_state.patients
         chirurgiens_list = st.session_state.chirurgiens
         
-        # Créer un DataFrame pour l'affichage
-        compat_data = []
-        for patient in patients_list:
-            row = {'Patient': f"{patient['id']} - {patient['nom']} {patient['prenom']}"}
-            for chirurgien in chirurgiens_list:
-                cle = (patient['id'], chirurgien['id'])
-                # Valeur par défaut: compatible (1) si non défini
-                valeur = st.session_state.compatibilite.get(cle, 1)
-                row[chirurgien['id']] = valeur
-            compat_data.append(row)
-        
-        df_compat = pd.DataFrame(compat_data)
+        # Créer un DataFrame pour l'affichage (mis en cache entre les reruns)
+        df_compat = construire_df_compat(
+            tuple((p['id'], p['nom'], p['prenom']) for p in patients_list),
+            tuple(c['id'] for c in chirurgiens_list),
+            st.session_state.compatibilite
+        )
         
         # Afficher avec possibilité d'édition
         edited_df = st.data_editor(
@@ -446,12 +812,12 @@ elif page == "⚙️ Compatibilité":
         
         # Sauvegarder les modifications
         if st.button("💾 Enregistrer les compatibilités"):
-            for idx, row in edited_df.iterrows():
-                patient_id = row['Patient'].split(" - ")[0]
-                for chirurgien in chirurgiens_list:
-                    chir_id = chirurgien['id']
-                    cle = (patient_id, chir_id)
-                    st.session_state.compatibilite[cle] = int(row[chir_id])
+            # Matrice int8 relue d'un bloc : identifiants depuis la colonne Patient
+            ids_edites = edited_df['Patient'].str.split(' - ', n=1).str[0]
+            st.session_state.compatibilite = (
+                edited_df.drop(columns='Patient').set_index(ids_edites)
+                .rename_axis(None).astype(np.int8)
+            )
             st.success("Compatibilités enregistrées!")
         
         # Légende
@@ -463,15 +829,23 @@ elif page == "⚙️ Compatibilité":
 elif page == "🔧 Optimisation":
     st.header("🔧 Optimisation du Planning")
     
+    # Données de session liées une fois à des noms locaux : plus de passage
+    # par le proxy st.session_state dans les boucles de préparation/résultats
+    patients = st.session_state.patients
+    salles = st.session_state.salles
+    chirurgiens = st.session_state.chirurgiens
+    jours = st.session_state.jours
+    compatibilite = st.session_state.compatibilite
+    
     # Vérifier les prérequis
     errors = []
-    if not st.session_state.patients:
+    if not patients:
         errors.append("❌ Aucun patient défini")
-    if not st.session_state.salles:
+    if not salles:
         errors.append("❌ Aucune salle définie")
-    if not st.session_state.chirurgiens:
+    if not chirurgiens:
         errors.append("❌ Aucun chirurgien défini")
-    if not st.session_state.jours:
+    if not jours:
         errors.append("❌ Aucun jour configuré")
     
     if errors:
@@ -485,18 +859,18 @@ elif page == "🔧 Optimisation":
         
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("Patients", len(st.session_state.patients))
-            duree_totale = sum(p['duree'] for p in st.session_state.patients)
+            st.metric("Patients", len(patients))
+            duree_totale = sum(p['duree'] for p in patients)
             st.metric("Durée totale", f"{duree_totale} min")
         
         with col2:
-            st.metric("Salles", len(st.session_state.salles))
-            capacite_totale = sum(s['capacite'] * len(st.session_state.jours) for s in st.session_state.salles)
+            st.metric("Salles", len(salles))
+            capacite_totale = sum(s['capacite'] * len(jours) for s in salles)
             st.metric("Capacité totale", f"{capacite_totale} min")
         
         with col3:
-            st.metric("Chirurgiens", len(st.session_state.chirurgiens))
-            st.metric("Jours", len(st.session_state.jours))
+            st.metric("Chirurgiens", len(chirurgiens))
+            st.metric("Jours", len(jours))
         
         # Paramètres d'optimisation
         st.subheader("Paramètres d'optimisation")
@@ -516,6 +890,13 @@ elif page == "🔧 Optimisation":
                 ["Minimiser temps libre", "Maximiser patients traités", "Équilibrer charge"]
             )
         
+        moteur = st.radio(
+            "Moteur de résolution",
+            ["CBC (exact)", "Heuristique rapide"],
+            horizontal=True,
+            help="L'heuristique rapide (glouton LPT) donne un planning réalisable instantanément, sans garantie d'optimalité"
+        )
+        
         # Bouton pour lancer l'optimisation
         st.divider()
         
@@ -527,99 +908,158 @@ elif page == "🔧 Optimisation":
                     # =============================================================
                     
                     # 1. Préparer les données pour votre modèle
-                    I = [p['id'] for p in st.session_state.patients]  # Patients
-                    J = [s['id'] for s in st.session_state.salles]    # Salles
-                    S = [c['id'] for c in st.session_state.chirurgiens] # Chirurgiens
-                    K = [j['numero'] for j in st.session_state.jours]   # Jours
+                    I = [p['id'] for p in patients]  # Patients
+                    J = [s['id'] for s in salles]    # Salles
+                    S = [c['id'] for c in chirurgiens] # Chirurgiens
+                    K = [j['numero'] for j in jours]   # Jours
                     
                     # Durées des patients
-                    t = {p['id']: p['duree'] for p in st.session_state.patients}
-                    
-                    # Capacités des salles (par jour)
-                    b = {(j_id, k): next(s['capacite'] for s in st.session_state.salles if s['id'] == j_id)
-                         for j_id in J for k in K}
+                    t = {p['id']: p['duree'] for p in patients}
                     
-                    # Disponibilités des chirurgiens (par jour)
-                    a = {(s_id, k): next(c['disponibilite'] for c in st.session_state.chirurgiens if c['id'] == s_id)
-                         for s_id in S for k in K}
+                    # Capacités des salles et disponibilités des chirurgiens (par jour) :
+                    # un tableau par attribut, lu une seule fois
+                    capacites = np.array([s['capacite'] for s in salles])
+                    disponibilites = np.array([c['disponibilite'] for c in chirurgiens])
+                    b = {(j_id, k): cap for j_id, cap in zip(J, capacites.tolist()) for k in K}
+                    a = {(s_id, k): dispo for s_id, dispo in zip(S, disponibilites.tolist()) for k in K}
                     
-                    # Matrice de compatibilité
-                    m = {}
-                    for patient in st.session_state.patients:
-                        for chirurgien in st.session_state.chirurgiens:
-                            cle = (patient['id'], chirurgien['id'])
-                            m[cle] = st.session_state.compatibilite.get(cle, 1)
+                    # Matrice de compatibilité (compatible par défaut, puis
+                    # saisies de l'utilisateur) et chirurgiens compatibles par patient
+                    M = compatibilite.reindex(index=I, columns=S, fill_value=1).to_numpy(dtype=bool)
+                    compat_is = {i: [S[c] for c in np.flatnonzero(M[r])] for r, i in enumerate(I)}
                     
-                    # 2. Créer et résoudre le modèle
-                    prob = pulp.LpProblem("ORS_idle_min", pulp.LpMinimize)
+                    # Patients sans aucun chirurgien compatible : non planifiables,
+                    # exclus du modèle (ni x ni z) et reportés tels quels
+                    non_planifiables = {i for i in I if not compat_is[i]}
+                    I_modele = [i for i in I if i not in non_planifiables]
                     
-                    # Variables
-                    x = pulp.LpVariable.dicts('x', (I, J, K), cat='Binary')
-                    y = pulp.LpVariable.dicts('y', (I, J, S, K), cat='Binary')
-                    
-                    # Objectif : minimiser temps libre
-                    prob += pulp.lpSum(
-                        b[(j, k)] - pulp.lpSum(t[i] * x[i][j][k] for i in I)
-                        for j in J for k in K
-                    ), "MinimizeIdleTime"
-                    
-                    # Contraintes
-                    for i in I:
-                        prob += pulp.lpSum(x[i][j][k] for j in J for k in K) <= 1, f"Once_{i}"
-                    
-                    for j in J:
-                        for k in K:
-                            prob += pulp.lpSum(t[i] * x[i][j][k] for i in I) <= b[(j, k)], f"ORcap_{j}_{k}"
-                    
-                    for s in S:
-                        for k in K:
-                            prob += pulp.lpSum(t[i] * y[i][j][s][k] for i in I for j in J) <= a[(s, k)], f"SurgeonCap_{s}_{k}"
-                    
-                    for i in I:
-                        for j in J:
-                            for s in S:
-                                for k in K:
-                                    prob += y[i][j][s][k] <= m.get((i, s), 0), f"Compat_{i}_{j}_{s}_{k}"
-                    
-                    for i in I:
+                    # 2. Créer et résoudre le modèle : écriture MPS directe + binaire
+                    # CBC ; modèle PuLP en secours si CBC n'a pas abouti. En mode
+                    # rapide, la solution gloutonne est utilisée telle quelle
+                    if moteur == "Heuristique rapide":
+                        # Glouton LPT seul, sans PuLP ni CBC
+                        gloutonne = affectation_gloutonne_lpt(I_modele, J, S, K, t, b, a, compat_is)
+                        solution = ('Solution heuristique',
+                                    {i: (j, k, [s]) for i, (j, k, s) in gloutonne.items()})
+                    else:
+                        solution = resoudre_mps_direct(I_modele, J, S, K, t, b, a, compat_is, time_limit)
+                    if solution is not None:
+                        statut_modele, affectations = solution
+                    else:
+                        solver = solveur_secours(time_limit)
+                        if solver is None:
+                            st.error("❌ Aucun solveur MILP disponible (CBC, HiGHS...) : "
+                                     "installez-en un ou utilisez le mode « Heuristique rapide ».")
+                            st.stop()
+                        prob = pulp.LpProblem("ORS_idle_min", pulp.LpMinimize)
+
+                        # Variables
+                        # Dictionnaire plat x[i, j, k], construit en une compréhension
+                        x = {(i, j, k): pulp.LpVariable(f"x_{i}_{j}_{k}", cat='Binary')
+                             for i in I_modele for j in J for k in K}
+                        # z[i, s, k] : patient i opéré par le chirurgien s le jour k, sans
+                        # indice de salle, et seulement pour les paires compatibles
+                        z = {(i, s, k): pulp.LpVariable(f"z_{i}_{s}_{k}", cat='Binary')
+                             for i in I_modele for s in compat_is[i] for k in K}
+
+                        # Index construits une fois : par (chirurgien, jour) et par (i, k)
+                        z_par_chirurgien = defaultdict(list)
+                        z_par_patient_jour = defaultdict(list)
+                        for (i, s, k), var in z.items():
+                            z_par_chirurgien[(s, k)].append((var, t[i]))
+                            z_par_patient_jour[(i, k)].append((var, 1))
+
+                        # Objectif : minimiser temps libre = capacité totale - temps opéré,
+                        # construit directement à partir des paires (variable, coefficient)
+                        prob += pulp.LpAffineExpression(
+                            [(x[i, j, k], -t[i]) for i in I_modele for j in J for k in K],
+                            constant=sum(b.values())
+                        ), "MinimizeIdleTime"
+
+                        # Contraintes
+                        for i in I_modele:
+                            prob += pulp.LpAffineExpression([(x[i, j, k], 1) for j in J for k in K]) <= 1, f"Once_{i}"
+
                         for j in J:
                             for k in K:
-                                prob += pulp.lpSum(y[i][j][s][k] for s in S) == x[i][j][k], f"Link_x_y_{i}_{j}_{k}"
-                    
-                    # Résoudre
-                    solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit)
-                    prob.solve(solver)
+                                prob += pulp.LpAffineExpression([(x[i, j, k], t[i]) for i in I_modele]) <= b[(j, k)], f"ORcap_{j}_{k}"
+
+                        for s in S:
+                            for k in K:
+                                prob += pulp.LpAffineExpression(z_par_chirurgien[(s, k)]) <= a[(s, k)], f"SurgeonCap_{s}_{k}"
+
+                        # Lien x-z par (patient, jour) : un chirurgien compatible ce jour-là
+                        # si et seulement si le patient est placé dans une salle ce jour-là
+                        for i in I_modele:
+                            for k in K:
+                                prob += pulp.LpAffineExpression(
+                                    z_par_patient_jour[(i, k)] + [(x[i, j, k], -1) for j in J]
+                                ) == 0, f"Link_x_z_{i}_{k}"
+
+                        # Bris de symétrie entre salles (puis chirurgiens) interchangeables
+                        groupes_salles, groupes_chirurgiens = groupes_symetriques(
+                            I_modele, J, S, K, b, a, compat_is)
+                        for j1, j2, k in paires_symetriques(groupes_salles, K):
+                            prob += pulp.LpAffineExpression(
+                                [(x[i, j1, k], t[i]) for i in I_modele] + [(x[i, j2, k], -t[i]) for i in I_modele]
+                            ) >= 0, f"SymSalle_{j1}_{j2}_{k}"
+                        for s1, s2, k in paires_symetriques(groupes_chirurgiens, K):
+                            prob += pulp.LpAffineExpression(
+                                [(var, duree) for var, duree in z_par_chirurgien[(s1, k)]]
+                                + [(var, -duree) for var, duree in z_par_chirurgien[(s2, k)]]
+                            ) >= 0, f"SymChir_{s1}_{s2}_{k}"
+
+                        # Démarrage à chaud : solution LPT gloutonne (renumérotée selon
+                        # les symétries) comme premier incumbent
+                        depart = ordonner_depart(
+                            affectation_gloutonne_lpt(I_modele, J, S, K, t, b, a, compat_is),
+                            t, K, groupes_salles, groupes_chirurgiens)
+                        for (i, j, k), var in x.items():
+                            place = depart.get(i)
+                            var.setInitialValue(1 if place and place[:2] == (j, k) else 0)
+                        for (i, s, k), var in z.items():
+                            place = depart.get(i)
+                            var.setInitialValue(1 if place and (place[1], place[2]) == (k, s) else 0)
+
+                        # Résoudre
+                        prob.solve(solver)
+                        statut_modele = pulp.LpStatus[prob.status]
+                        # Lecture directe de varValue (sans passer par pulp.value)
+                        affectations = assembler_affectations(
+                            [cle for cle, var in x.items() if (var.varValue or 0) > 0.5],
+                            [cle for cle, var in z.items() if (var.varValue or 0) > 0.5]
+                        )
                     
                     # 3. Traiter les résultats
+                    # Index par identifiant : recherches O(1) au lieu de next(...)
+                    patients_par_id = {p['id']: p for p in patients}
+                    salles_par_id = {s['id']: s for s in salles}
+                    jours_par_numero = {d['numero']: d for d in jours}
+                    
                     planning_details = []
+                    # Temps utilisé par (salle, jour), accumulé pendant la construction
+                    utilise_par_creneau = defaultdict(int)
                     
                     for i in I:
-                        scheduled = False
-                        for j in J:
-                            for k in K:
-                                if pulp.value(x[i][j][k]) > 0.5:
-                                    scheduled = True
-                                    surgeons_assigned = [s for s in S if pulp.value(y[i][j][s][k]) > 0.5]
-                                    
-                                    # Récupérer les infos du patient
-                                    patient_info = next(p for p in st.session_state.patients if p['id'] == i)
-                                    salle_info = next(s for s in st.session_state.salles if s['id'] == j)
-                                    jour_info = next(d for d in st.session_state.jours if d['numero'] == k)
-                                    
-                                    planning_details.append({
-                                        'patient_id': i,
-                                        'patient_nom': f"{patient_info['nom']} {patient_info['prenom']}",
-                                        'patient_duree': patient_info['duree'],
-                                        'salle_id': j,
-                                        'salle_nom': salle_info['nom'],
-                                        'jour_numero': k,
-                                        'jour_date': jour_info['date'],
-                                        'chirurgiens': ', '.join(surgeons_assigned),
-                                        'statut': 'Planifié'
-                                    })
-                        
-                        if not scheduled:
-                            patient_info = next(p for p in st.session_state.patients if p['id'] == i)
+                        patient_info = patients_par_id[i]
+                        if i in affectations:
+                            j, k, surgeons_assigned = affectations[i]
+                            salle_info = salles_par_id[j]
+                            jour_info = jours_par_numero[k]
+                            utilise_par_creneau[(j, k)] += patient_info['duree']
+                            
+                            planning_details.append({
+                                'patient_id': i,
+                                'patient_nom': f"{patient_info['nom']} {patient_info['prenom']}",
+                                'patient_duree': patient_info['duree'],
+                                'salle_id': j,
+                                'salle_nom': salle_info['nom'],
+                                'jour_numero': k,
+                                'jour_date': jour_info['date'],
+                                'chirurgiens': ', '.join(surgeons_assigned),
+                                'statut': 'Planifié'
+                            })
+                        else:
                             planning_details.append({
                                 'patient_id': i,
                                 'patient_nom': f"{patient_info['nom']} {patient_info['prenom']}",
@@ -629,25 +1069,23 @@ elif page == "🔧 Optimisation":
                                 'jour_numero': '-',
                                 'jour_date': '-',
                                 'chirurgiens': '-',
-                                'statut': 'Non planifié'
+                                'statut': ('Non planifié (aucun chirurgien compatible)'
+                                           if i in non_planifiables else 'Non planifié')
                             })
                     
-                    # Calculer les statistiques
+                    # Calculer les statistiques (libellés de jour formatés une seule fois)
+                    libelle_jour = {k: f"Jour {k} ({jours_par_numero[k]['date']})" for k in K}
                     stats_utilisation = []
                     for j in J:
-                        salle_info = next(s for s in st.session_state.salles if s['id'] == j)
+                        salle_info = salles_par_id[j]
                         for k in K:
-                            jour_info = next(d for d in st.session_state.jours if d['numero'] == k)
-                            used = sum(
-                                p['patient_duree'] for p in planning_details 
-                                if p['salle_id'] == j and p['jour_numero'] == k and p['statut'] == 'Planifié'
-                            )
+                            used = utilise_par_creneau[(j, k)]
                             capacity = salle_info['capacite']
                             taux = (used / capacity * 100) if capacity > 0 else 0
                             
                             stats_utilisation.append({
                                 'salle': salle_info['nom'],
-                                'jour': f"Jour {k} ({jour_info['date']})",
+                                'jour': libelle_jour[k],
                                 'utilise': used,
                                 'capacite': capacity,
                                 'taux': round(taux, 1)
@@ -657,12 +1095,12 @@ elif page == "🔧 Optimisation":
                     st.session_state.planning_result = {
                         'details': planning_details,
                         'stats': stats_utilisation,
-                        'status': pulp.LpStatus[prob.status],
-                        'objective_value': pulp.value(prob.objective),
-                        'model': prob
+                        'status': statut_modele,
+                        # Temps libre = capacité totale - temps opéré
+                        'objective_value': sum(b.values()) - sum(t[i] for i in affectations)
                     }
                     
-                    st.session_state.model_status = pulp.LpStatus[prob.status]
+                    st.session_state.model_status = statut_modele
                     
                     st.success("✅ Optimisation terminée avec succès!")
                     st.balloons()
@@ -703,15 +1141,9 @@ elif page == "📊 Résultats":
             df_display = df_planning[display_cols].copy()
             df_display.columns = ['Patient', 'Durée (min)', 'Salle', 'Date', 'Chirurgien(s)', 'Statut']
             
-            # Colorier les lignes selon le statut
-            def color_row(row):
-                if row['Statut'] == 'Planifié':
-                    return ['background-color: #d4edda'] * len(row)
-                else:
-                    return ['background-color: #f8d7da'] * len(row)
-            
-            styled_df = df_display.style.apply(color_row, axis=1)
-            st.dataframe(styled_df, use_container_width=True, hide_index=True)
+            # Pastille de statut en colonne (sérialisée par Arrow, sans Styler)
+            df_display.insert(0, '', np.where(df_display['Statut'] == 'Planifié', '🟢', '🔴'))
+            st.dataframe(df_display, use_container_width=True, hide_index=True)
             
             # Résumé
             col1, col2, col3 = st.columns(3)
@@ -719,7 +1151,7 @@ elif page == "📊 Résultats":
                 planifies = sum(1 for p in result['details'] if p['statut'] == 'Planifié')
                 st.metric("Patients planifiés", planifies)
             with col2:
-                non_planifies = sum(1 for p in result['details'] if p['statut'] == 'Non planifié')
+                non_planifies = sum(1 for p in result['details'] if p['statut'] != 'Planifié')
                 st.metric("Patients non planifiés", non_planifies)
             with col3:
                 taux = (planifies / len(result['details']) * 100) if result['details'] else 0
@@ -755,29 +1187,25 @@ elif page == "📊 Résultats":
         with tab3:
             st.subheader("Vue par jour et salle")
             
-            # Filtrer par jour
-            jours_uniques = sorted(set(p['jour_date'] for p in result['details'] if p['jour_date'] != '-'))
+            # Patients planifiés (DataFrame de l'onglet détaillé), groupés par salle
+            planifies_df = df_planning[df_planning['statut'] == 'Planifié']
+            jours_uniques = sorted(planifies_df['jour_date'].unique())
             jour_selectionne = st.selectbox("Sélectionner un jour", jours_uniques)
             
             # Filtrer les données
-            planning_jour = [p for p in result['details'] if p['jour_date'] == jour_selectionne and p['statut'] == 'Planifié']
+            planning_jour = planifies_df[planifies_df['jour_date'] == jour_selectionne]
             
-            if planning_jour:
-                # Grouper par salle
-                salles_jour = set(p['salle_nom'] for p in planning_jour if p['salle_nom'] != '-')
-                
-                for salle in salles_jour:
+            if not planning_jour.empty:
+                for salle, patients_salle in planning_jour.groupby('salle_nom', sort=True):
                     with st.expander(f"🚪 {salle}", expanded=True):
-                        patients_salle = [p for p in planning_jour if p['salle_nom'] == salle]
-                        
-                        for patient in patients_salle:
+                        for patient in patients_salle.itertuples(index=False):
                             col1, col2, col3 = st.columns([3, 2, 2])
                             with col1:
-                                st.write(f"**{patient['patient_nom']}**")
+                                st.write(f"**{patient.patient_nom}**")
                             with col2:
-                                st.write(f"⏱️ {patient['patient_duree']} min")
+                                st.write(f"⏱️ {patient.patient_duree} min")
                             with col3:
-                                st.write(f"👨‍⚕️ {patient['chirurgiens']}")
+                                st.write(f"👨‍⚕️ {patient.chirurgiens}")
                             st.divider()
             else:
                 st.info(f"Aucun patient planifié pour le {jour_selectionne}")
@@ -789,7 +1217,7 @@ elif page == "📊 Résultats":
             
             with col1:
                 # Export CSV
-                csv = pd.DataFrame(result['details']).to_csv(index=False)
+                csv = exporter_csv(result['details'])
                 st.download_button(
                     label="📥 Télécharger CSV",
                     data=csv,
@@ -800,15 +1228,11 @@ elif page == "📊 Résultats":
             
             with col2:
                 # Export Excel
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    pd.DataFrame(result['details']).to_excel(writer, sheet_name='Planning', index=False)
-                    if 'stats' in result:
-                        pd.DataFrame(result['stats']).to_excel(writer, sheet_name='Statistiques', index=False)
+                excel = exporter_excel(result['details'], result.get('stats'))
                 
                 st.download_button(
                     label="📊 Télécharger Excel",
-                    data=output.getvalue(),
+                    data=excel,
                     file_name="planning_clinique.xlsx",
                     mime="application/vnd.ms-excel",
                     use_container_width=True
@@ -816,7 +1240,7 @@ elif page == "📊 Résultats":
             
             with col3:
                 # Export JSON
-                json_data = json.dumps(result, indent=2, default=str)
+                json_data = exporter_json(result)
                 st.download_button(
                     label="📋 Télécharger JSON",
                     data=json_data,
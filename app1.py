@@ -3,107 +3,511 @@ import streamlit as st
 import pulp
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+import pyarrow as pa
+from datetime import datetime, timedelta, time
 import json
+import hashlib
 import io
+import os
+from collections import defaultdict
+from itertools import groupby, product
+from time import perf_counter
+
+try:
+    from numba import njit
+except ImportError:  # Numba est optionnel : repli sur le calcul NumPy vectorisé
+    njit = None
+
+# Valeurs par défaut des créneaux : objets time construits directement
+# (pas d'analyse de chaîne 'HH:MM' à chaque exécution du script)
+HEURE_DEBUT_DEFAUT = time(8, 0)
+HEURE_FIN_DEFAUT = time(18, 0)
+
+# Statuts possibles d'un patient dans le planning (colonne catégorielle)
+STATUTS = ['Planifié', 'Non planifié', 'Non planifié (hors créneau)']
+
+# Budget de résolution (secondes) partagé entre relaxation LP et MILP, et
+# nombre de variables y au-delà duquel la relaxation guide l'heuristique
+DUREE_MAX_RESOLUTION = 60
+SEUIL_RELAXATION = 2000
+
+# ============================================================================
+# MODÈLE MILP - DONNÉES ET SOLVEUR
+# ============================================================================
+def choisir_solveur(time_limit=60, warm_start=False):
+    """
+    Solveur MILP : HiGHS (API highspy, puis binaire highs) s'il est
+    disponible, sinon CBC fourni avec PuLP. L'API highspy de PuLP ne gère
+    pas le démarrage à chaud : elle est ignorée quand warm_start est demandé.
+    """
+    solveurs = [pulp.HiGHS_CMD(msg=False, timeLimit=time_limit, threads=os.cpu_count(),
+                               warmStart=warm_start)]
+    if not warm_start:
+        solveurs.insert(0, pulp.HiGHS(msg=False, timeLimit=time_limit))
+    for solveur in solveurs:
+        if solveur.available():
+            return solveur
+    return pulp.PULP_CBC_CMD(msg=False, timeLimit=time_limit, warmStart=warm_start, gapRel=0.01,
+                             options=['knapsack on', 'gomory on', 'feas on'])
+
+
+def affectation_gloutonne_lpt(I, J, S, K, t, b, a, compat_is, poids=None):
+    """
+    Heuristique LPT : patients par durée décroissante, chacun placé dans le
+    couple (salle, jour) le moins chargé où il tient, avec le chirurgien
+    compatible le plus disponible ce jour-là. Avec `poids` (valeurs de la
+    relaxation LP par (i, j, s, k)), les affectations les plus fortes de la
+    relaxation sont préférées : arrondi + réparation. Retourne {i: (j, k, s)}.
+    """
+    poids = poids or {}
+    reste_salle = dict(b)
+    reste_chir = dict(a)
+    affectation = {}
+    for i in sorted(I, key=t.__getitem__, reverse=True):
+        duree = t[i]
+        meilleur = None
+        for j in J:
+            for k in K:
+                if reste_salle[(j, k)] < duree:
+                    continue
+                for s in compat_is[i]:
+                    if reste_chir[(s, k)] < duree:
+                        continue
+                    score = (poids.get((i, j, s, k), 0), reste_salle[(j, k)], reste_chir[(s, k)])
+                    if meilleur is None or score > meilleur[0]:
+                        meilleur = (score, j, k, s)
+        if meilleur is not None:
+            _, j, k, s = meilleur
+            reste_salle[(j, k)] -= duree
+            reste_chir[(s, k)] -= duree
+            affectation[i] = (j, k, s)
+    return affectation
+
+
+def empreinte_donnees(patients, salles, chirurgiens, jours, compatibilite):
+    """
+    Clé de cache stable (blake2b) des données du modèle : les fonctions mises
+    en cache ne hachent plus que cette courte chaîne à chaque rerun.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([patients, salles, chirurgiens, jours,
+                         list(compatibilite.index), list(compatibilite.columns)],
+                        sort_keys=True, default=str).encode())
+    h.update(compatibilite.to_numpy(dtype=np.uint8).tobytes())
+    return h.hexdigest()
+
+
+@st.cache_data(show_spinner=False)
+def preparer_donnees_modele(cle, _patients, _salles, _chirurgiens, _jours, _compatibilite):
+    """
+    Ensembles, paramètres et index du modèle MILP. Mis en cache sur la clé
+    `cle` (empreinte_donnees) : les arguments préfixés par _ ne sont pas
+    hachés par Streamlit.
+    """
+    patients, salles, chirurgiens = _patients, _salles, _chirurgiens
+    jours, compatibilite = _jours, _compatibilite
+    I = [p['id'] for p in patients]
+    J = [s['id'] for s in salles]
+    S = [c['id'] for c in chirurgiens]
+    K = [j['numero'] for j in jours]
+    
+    # Index par identifiant (une seule passe sur chaque liste)
+    cap_by_salle = {s['id']: s['capacite'] for s in salles}
+    disp_by_chir = {c['id']: c['disponibilite'] for c in chirurgiens}
+    
+    # MATRICE DE COMPATIBILITÉ (m) : paires absentes compatibles par défaut
+    m = compatibilite.reindex(index=I, columns=S, fill_value=1).to_numpy(dtype=bool)
+    
+    return {
+        'I': I, 'J': J, 'S': S, 'K': K,
+        # Durées patients
+        't': {p['id']: p['duree'] for p in patients},
+        # Capacités salles
+        'b': {(j_id, k): cap_by_salle[j_id] for j_id in J for k in K},
+        # Disponibilités chirurgiens
+        'a': {(s_id, k): disp_by_chir[s_id] for s_id in S for k in K},
+        # Chirurgiens compatibles par patient
+        'compat_is': {i: [S[c] for c in np.flatnonzero(m[r])] for r, i in enumerate(I)},
+        'patients_by_id': {p['id']: p for p in patients},
+        'salles_by_id': {s['id']: s for s in salles},
+        'jours_by_num': {d['numero']: d for d in jours},
+    }
+
+
+@st.cache_data(show_spinner=False)
+def resoudre_milp(cle, _patients, _salles, _chirurgiens, _jours, _compatibilite):
+    """
+    Construit et résout le modèle MILP, puis extrait le planning journalier
+    (sans heures). Mis en cache sur l'empreinte des données `cle` : relancer
+    l'optimisation après un simple changement des paramètres
+    d'ordonnancement ne résout pas à nouveau le modèle.
+    """
+    # Préparation des données pour le modèle (mise en cache)
+    donnees = preparer_donnees_modele(cle, _patients, _salles, _chirurgiens, _jours, _compatibilite)
+    I, J, S, K = donnees['I'], donnees['J'], donnees['S'], donnees['K']
+    t, b, a = donnees['t'], donnees['b'], donnees['a']
+    compat_is = donnees['compat_is']
+    patients_by_id = donnees['patients_by_id']
+    salles_by_id = donnees['salles_by_id']
+    jours_by_num = donnees['jours_by_num']
+    
+    # Création du modèle MILP
+    prob = pulp.LpProblem("Planning_Clinique", pulp.LpMaximize)
+    
+    # Variables
+    # x[i, j, k] = sum_s y[i, j, s, k] (contrainte de lien substituée) : seul y
+    # est créé, et uniquement pour les chirurgiens compatibles et les créneaux
+    # (salle, jour) pouvant contenir l'intervention (t[i] <= b[(j, k)])
+    creneaux = list(product(J, K))
+    y = {(i, j, s, k): pulp.LpVariable(f"y_{i}_{j}_{s}_{k}", cat='Binary')
+         for i in I for (j, k) in creneaux if t[i] <= b[(j, k)]
+         for s in compat_is[i]}
+    
+    # Index par patient, par créneau et par chirurgien-jour, construits en
+    # une passe sur y : aucune contrainte n'est posée sur une variable absente
+    y_par_patient = defaultdict(list)
+    y_par_creneau = defaultdict(list)
+    y_par_chirurgien = defaultdict(list)
+    for (i, j, s, k), var in y.items():
+        y_par_patient[i].append(var)
+        y_par_creneau[(j, k)].append((var, t[i]))
+        y_par_chirurgien[(s, k)].append((var, t[i]))
+    
+    # Objectif : minimiser le temps libre sum(b) - sum(t*x), soit, sum(b)
+    # étant constant, maximiser le temps utilisé
+    # Termes conservés à plat pour réévaluer l'objectif en NumPy après résolution
+    y_flat = list(y.values())
+    t_flat = np.fromiter((t[i] for (i, j, s, k) in y), dtype=np.int64, count=len(y_flat))
+    prob += pulp.LpAffineExpression(zip(y_flat, t_flat.tolist()))
+    
+    # Contraintes (un seul créneau et un seul chirurgien par patient)
+    for i in I:
+        prob += pulp.lpSum(y_par_patient[i]) <= 1, f"Once_{i}"
+    
+    # Capacités : expressions construites d'un bloc à partir de (variable, coef)
+    for j, k in creneaux:
+        prob += pulp.LpAffineExpression(y_par_creneau[(j, k)]) <= b[(j, k)], f"ORcap_{j}_{k}"
+    
+    for s, k in product(S, K):
+        prob += pulp.LpAffineExpression(y_par_chirurgien[(s, k)]) <= a[(s, k)], f"SurgeonCap_{s}_{k}"
+    
+    def temps_affecte(affectation):
+        return sum(t[i] for i in affectation)
+    
+    # 1. Heuristique LPT ; sur les grands modèles, relaxation LP (y continus
+    # dans [0, 1]) puis arrondi + réparation guidés par celle-ci, et on garde
+    # la meilleure des deux. La relaxation est prise sur le budget du MILP.
+    debut_resolution = perf_counter()
+    candidats = [affectation_gloutonne_lpt(I, J, S, K, t, b, a, compat_is)]
+    if len(y_flat) > SEUIL_RELAXATION:
+        for var in y_flat:
+            var.cat = pulp.LpContinuous
+        prob.solve(choisir_solveur(time_limit=DUREE_MAX_RESOLUTION))
+        valeurs_lp = {cle_y: var.varValue for cle_y, var in y.items() if var.varValue}
+        for var in y_flat:
+            var.cat = pulp.LpInteger
+        candidats.append(affectation_gloutonne_lpt(I, J, S, K, t, b, a, compat_is, poids=valeurs_lp))
+    heuristique = max(candidats, key=temps_affecte)
+    
+    # 2. MILP avec démarrage à chaud sur la solution heuristique, dans le
+    # temps restant du budget
+    for (i, j, s, k), var in y.items():
+        var.setInitialValue(1 if heuristique.get(i) == (j, k, s) else 0)
+    
+    temps_restant = max(1, int(DUREE_MAX_RESOLUTION - (perf_counter() - debut_resolution)))
+    solver = choisir_solveur(time_limit=temps_restant, warm_start=True)
+    prob.solve(solver)
+    statut = pulp.LpStatus[prob.status]
+    
+    # Récupération des résultats
+    # Lecture directe de varValue (sans passer par pulp.value)
+    affectations = {i: (j, k, s) for (i, j, s, k), var in y.items()
+                    if (var.varValue or 0) > 0.5}
+    temps_utilise = float(
+        np.fromiter((v.varValue or 0 for v in y_flat), dtype=np.float64, count=len(y_flat)).dot(t_flat)
+    )
+    
+    # Limite de temps atteinte sans solution entière meilleure : on renvoie
+    # la solution heuristique (toujours réalisable)
+    if prob.status != pulp.LpStatusOptimal or temps_utilise < temps_affecte(heuristique):
+        affectations = heuristique
+        temps_utilise = float(temps_affecte(heuristique))
+        statut = 'Solution heuristique'
+    
+    # Planning journalier en colonnes typées (une ligne par patient, ordre de I)
+    infos = [patients_by_id[i] for i in I]
+    places = [affectations.get(i) for i in I]
+    planning_details = pd.DataFrame({
+        'patient_id': pd.Categorical(I),
+        'patient_nom': [f"{p['nom']} {p['prenom']}" for p in infos],
+        'patient_duree': np.fromiter((p['duree'] for p in infos), dtype=np.int64, count=len(I)),
+        'priorite': np.fromiter((p.get('priorite', 3) for p in infos), dtype=np.int64, count=len(I)),
+        'salle_id': pd.Categorical([pl[0] if pl else None for pl in places]),
+        'salle_nom': [salles_by_id[pl[0]]['nom'] if pl else '' for pl in places],
+        'jour_numero': pd.Categorical([pl[1] if pl else None for pl in places]),
+        'jour_date': [jours_by_num[pl[1]]['date'] if pl else '' for pl in places],
+        'chirurgiens': [pl[2] if pl else '' for pl in places],
+        'statut': pd.Categorical(['Planifié' if pl else 'Non planifié' for pl in places],
+                                 categories=STATUTS),
+    })
+    
+    return {
+        'details': planning_details,
+        'statut': statut,
+        'objectif': sum(b.values()) - temps_utilise
+    }
 
 # ============================================================================
 # FONCTION D'ORDONNANCEMENT HORAIRE - POST-TRAITEMENT
 # ============================================================================
+def _lpt_pack_cumsum(durees, groupes, h_debut, h_fin, pause):
+    """
+    Placement séquentiel vectorisé : fin = h_debut + cumsum(durée + pause) - pause
+    par groupe, obtenu par un seul cumsum NumPy global moins son niveau au
+    début du groupe. Un patient qui déborde est écarté sans avancer l'heure
+    courante ; on retire donc le premier débordement de chaque groupe et on
+    recalcule.
+    """
+    n = durees.shape[0]
+    debut_groupe = np.ones(n, dtype=np.bool_)
+    debut_groupe[1:] = groupes[1:] != groupes[:-1]
+    idx_debut = np.flatnonzero(debut_groupe)
+    tailles = np.diff(np.append(idx_debut, n))
+    place = np.ones(n, dtype=np.bool_)
+    while True:
+        pas = np.where(place, durees + pause, 0)
+        cumul = np.cumsum(pas)
+        decalage = np.repeat(cumul[idx_debut] - pas[idx_debut], tailles)
+        fin = h_debut + cumul - decalage - pause
+        deborde = np.flatnonzero(place & (fin > h_fin))
+        if deborde.size == 0:
+            break
+        premiers = np.ones(deborde.size, dtype=np.bool_)
+        premiers[1:] = groupes[deborde[1:]] != groupes[deborde[:-1]]
+        place[deborde[premiers]] = False
+    return fin - durees, fin, place
+
+
+def _lpt_pack_boucle(durees, groupes, h_debut, h_fin, pause):
+    """
+    Noyau LPT séquentiel sur tableaux contigus (compilé par Numba).
+    Les patients sont déjà triés ; l'heure courante repart de h_debut à
+    chaque changement de groupe (salle, jour).
+    """
+    n = durees.shape[0]
+    debuts = np.zeros(n, dtype=np.int64)
+    fins = np.zeros(n, dtype=np.int64)
+    ok = np.zeros(n, dtype=np.bool_)
+    heure_courante = h_debut
+    for idx in range(n):
+        if idx == 0 or groupes[idx] != groupes[idx - 1]:
+            heure_courante = h_debut
+        fin = heure_courante + durees[idx]
+        if fin <= h_fin:
+            debuts[idx] = heure_courante
+            fins[idx] = fin
+            ok[idx] = True
+            heure_courante = fin + pause
+    return debuts, fins, ok
+
+
+@st.cache_resource(show_spinner=False)
+def noyau_lpt():
+    """
+    Noyau d'ordonnancement LPT : _lpt_pack_boucle compilé par Numba (signature
+    explicite, cache disque) au premier ordonnancement, une seule fois par
+    processus ; sinon repli sur _lpt_pack_cumsum.
+    """
+    if njit is None:
+        return _lpt_pack_cumsum
+    return njit('Tuple((int64[::1], int64[::1], boolean[::1]))'
+                '(int64[::1], int64[::1], int64, int64, int64)',
+                cache=True)(_lpt_pack_boucle)
+
+
+def _tri_radix(cles):
+    """
+    Équivalent de np.lexsort pour des clés entières bornées (durées, priorités,
+    codes de catégories) : une passe stable par clé, de la moins à la plus
+    significative, sur des uint16 que NumPy trie par base en O(n). Repli sur
+    np.lexsort si l'étendue d'une clé dépasse 16 bits.
+    """
+    n = cles[0].shape[0]
+    ordre = np.arange(n)
+    if n == 0:
+        return ordre
+    etendue_max = np.iinfo(np.uint16).max
+    if any(cle.max() - cle.min() > etendue_max for cle in cles):
+        return np.lexsort(cles)
+    for cle in cles:
+        compacte = (cle - cle.min()).astype(np.uint16)
+        ordre = ordre[np.argsort(compacte[ordre], kind='stable')]
+    return ordre
+
+
+@st.cache_resource(show_spinner=False)
+def table_hhmm():
+    """
+    Table minute -> 'HH:MM' sur une journée (0 à 24:00), construite une
+    seule fois par processus et partagée entre les réexécutions.
+    """
+    return np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(24 * 60 + 1)])
+
+
+def formater_hhmm(minutes):
+    """Minutes depuis minuit -> 'HH:MM' par indexation dans table_hhmm()."""
+    return table_hhmm()[np.clip(minutes, 0, 24 * 60)]
+
+
+# Règles d'ordre dans la journée : (clé, croissant) par ordre de priorité
+REGLES_ORDRE = {
+    'duree_desc': [('patient_duree', False)],                   # LPT
+    'priorite': [('priorite', True)],
+    'fifo': [('patient_id', True)],
+    'mixte': [('priorite', True), ('patient_duree', False)],
+}
+
+
 def appliquer_ordonnancement_horaire(planning_brut, heure_debut="08:00", 
                                      heure_fin="18:00", pause=15, 
                                      regle_ordre="duree_desc"):
     """
     RÈGLE D'ORDONNANCEMENT ACADÉMIQUE - Post-traitement du modèle MILP
+    
+    Tri vectorisé (radix par clé) par (salle, jour) + règle, puis placement
+    séquentiel via noyau_lpt() (Numba si disponible, sinon cumsum NumPy).
+    Entrée et sortie : DataFrame du planning, une ligne par patient.
     """
     # Conversion heures en minutes
     h_debut = int(heure_debut.split(':')[0])*60 + int(heure_debut.split(':')[1])
     h_fin = int(heure_fin.split(':')[0])*60 + int(heure_fin.split(':')[1])
-    capacite = h_fin - h_debut
-    
-    # Initialisation
-    planning_final = []
-    patients_non_planifies = []
     
     # 1. Séparer patients planifiés/non-planifiés
-    for patient in planning_brut:
-        if patient.get('statut') == 'Planifié':
-            planning_final.append(patient)
-        else:
-            patients_non_planifies.append(patient)
+    est_planifie = (planning_brut['statut'] == 'Planifié').to_numpy()
+    planifies = planning_brut[est_planifie]
+    patients_non_planifies = planning_brut[~est_planifie].copy()
     
-    # 2. Grouper par salle et jour
-    groupes = {}
-    for patient in planning_final:
-        cle = (patient.get('salle_id'), patient.get('jour_numero'))
-        if cle not in groupes:
-            groupes[cle] = []
-        groupes[cle].append(patient)
+    # Clés extraites une fois chacune, seulement celles que la règle utilise
+    # (règle LPT par défaut : groupe + durée) ; catégories -> codes entiers
+    regle = REGLES_ORDRE.get(regle_ordre, REGLES_ORDRE['duree_desc'])
+    cles = {}
+    for c in ['salle_id', 'jour_numero', 'patient_duree'] + [c for c, _ in regle]:
+        if c not in cles:
+            colonne = planifies[c]
+            cles[c] = (colonne.cat.codes.to_numpy()
+                       if isinstance(colonne.dtype, pd.CategoricalDtype)
+                       else colonne.to_numpy(np.int64))
     
-    # Réinitialiser planning_final
-    planning_final = []
+    # 2. RÈGLE DE TRI : une seule permutation stable (dernière clé = clé
+    # primaire) avec le groupe (salle, jour) en tête
+    cles_tri = [cles[c] if croissant else -cles[c] for c, croissant in reversed(regle)]
+    ordre = _tri_radix(cles_tri + [cles['jour_numero'], cles['salle_id']])
     
-    # 3. Pour chaque groupe, appliquer la règle d'ordonnancement
-    for (salle_id, jour_numero), patients in groupes.items():
-        
-        # RÈGLE DE TRI
-        if regle_ordre == 'duree_desc':
-            patients_tries = sorted(patients, 
-                                   key=lambda x: x.get('patient_duree', 0), 
-                                   reverse=True)
-        elif regle_ordre == 'priorite':
-            patients_tries = sorted(patients, 
-                                   key=lambda x: x.get('priorite', 999))
-        elif regle_ordre == 'fifo':
-            patients_tries = sorted(patients, 
-                                   key=lambda x: x.get('patient_id', ''))
-        elif regle_ordre == 'mixte':
-            patients_tries = sorted(patients,
-                                   key=lambda x: (x.get('priorite', 999), 
-                                                 -x.get('patient_duree', 0)))
-        else:
-            patients_tries = sorted(patients, 
-                                   key=lambda x: x.get('patient_duree', 0), 
-                                   reverse=True)
-        
-        # 4. Assignation séquentielle des heures
-        heure_courante = h_debut
-        
-        for patient in patients_tries:
-            duree = patient.get('patient_duree', 0)
-            
-            # Vérifier capacité horaire
-            if heure_courante + duree <= h_debut + capacite:
-                # Calcul des heures
-                h_debut_patient = heure_courante
-                h_fin_patient = heure_courante + duree
-                
-                # Formatage HH:MM
-                patient['heure_debut'] = f"{h_debut_patient//60:02d}:{h_debut_patient%60:02d}"
-                patient['heure_fin'] = f"{h_fin_patient//60:02d}:{h_fin_patient%60:02d}"
-                
-                # Stockage en minutes pour tri
-                patient['heure_debut_min'] = h_debut_patient
-                patient['heure_fin_min'] = h_fin_patient
-                
-                planning_final.append(patient)
-                
-                # Incrémentation avec pause
-                heure_courante = h_fin_patient + pause
-            else:
-                # Capacité insuffisante
-                patient['statut'] = 'Non planifié (hors créneau)'
-                patient['heure_debut'] = 'N/A'
-                patient['heure_fin'] = 'N/A'
-                planning_final.append(patient)
+    # Numéro de groupe : incrémenté à chaque changement de (salle, jour)
+    salles_t = cles['salle_id'][ordre]
+    jours_t = cles['jour_numero'][ordre]
+    nouveau = np.ones(len(ordre), dtype=np.int64)
+    nouveau[1:] = (salles_t[1:] != salles_t[:-1]) | (jours_t[1:] != jours_t[:-1])
+    groupe = np.cumsum(nouveau)
+    
+    # 3. Assignation séquentielle des heures
+    debut, fin, place = noyau_lpt()(np.ascontiguousarray(cles['patient_duree'][ordre]), groupe,
+                                    h_debut, h_fin, int(pause))
+    
+    # 4. Résultats en colonnes, dans l'ordre trié (minutes conservées pour le tri)
+    planning_final = planifies.iloc[ordre].reset_index(drop=True)
+    planning_final['heure_debut'] = np.where(place, formater_hhmm(debut), 'N/A')
+    planning_final['heure_fin'] = np.where(place, formater_hhmm(fin), 'N/A')
+    planning_final['heure_debut_min'] = pd.Series(debut).where(place).astype('Int64')
+    planning_final['heure_fin_min'] = pd.Series(fin).where(place).astype('Int64')
+    # Capacité insuffisante
+    planning_final.loc[~place, 'statut'] = 'Non planifié (hors créneau)'
     
     # 5. Ajouter patients non planifiés originaux
-    for patient in patients_non_planifies:
-        patient['heure_debut'] = 'N/A'
-        patient['heure_fin'] = 'N/A'
-        planning_final.append(patient)
+    patients_non_planifies['heure_debut'] = 'N/A'
+    patients_non_planifies['heure_fin'] = 'N/A'
+    patients_non_planifies['heure_debut_min'] = pd.Series(pd.NA, index=patients_non_planifies.index, dtype='Int64')
+    patients_non_planifies['heure_fin_min'] = pd.Series(pd.NA, index=patients_non_planifies.index, dtype='Int64')
+    
+    return pd.concat([planning_final, patients_non_planifies], ignore_index=True)
+
+# ============================================================================
+# PLANNING FINAL - TABLEAU ET EXPORT (mis en cache entre les reruns)
+# ============================================================================
+@st.cache_data(show_spinner=False)
+def construire_tableau_final(planning):
+    """
+    Tableau affiché du planning (colonnes renommées, 'N/A' hors créneau),
+    trié par date puis heure, patients sans créneau en fin de tableau.
+    """
+    avec_heure = planning['heure_debut'] != 'N/A'
+    df_final = pd.DataFrame({
+        'Patient': planning['patient_nom'],
+        'Durée (min)': planning['patient_duree'],
+        'Priorité': planning['priorite'],
+        'Salle': planning['salle_nom'].where(avec_heure, 'N/A'),
+        'Date': planning['jour_date'].where(avec_heure, 'N/A'),
+        'Début': planning['heure_debut'],
+        'Fin': planning['heure_fin'],
+        'Chirurgien(s)': planning['chirurgiens'].where(avec_heure, 'N/A'),
+        'Statut': np.where(avec_heure, '✅ Planifié', '❌ ' + planning['statut'].astype(str)),
+    })
+    
+    # Date ISO (tri lexicographique = chronologique, 'N/A' en dernier) puis
+    # minutes de début déjà calculées par l'ordonnancement : aucun parsing
+    df_final['_tri_heure'] = planning['heure_debut_min'].fillna(9999)
+    df_final = df_final.sort_values(['Date', '_tri_heure'], kind='mergesort').drop(columns='_tri_heure')
     
-    return planning_final
+    # Types compacts : entiers réduits, libellés répétés en catégories
+    df_final['Durée (min)'] = pd.to_numeric(df_final['Durée (min)'], downcast='integer')
+    df_final['Priorité'] = df_final['Priorité'].astype('Int8')
+    for col in ['Salle', 'Date', 'Chirurgien(s)', 'Statut']:
+        df_final[col] = df_final[col].astype('category')
+    return df_final
+
+
+@st.cache_data(show_spinner=False)
+def grouper_vue_par_jour(planning):
+    """
+    Rendez-vous avec créneau regroupés une fois par jour puis par salle
+    ({jour: {salle: DataFrame}}), chaque groupe déjà trié par heure de début.
+    """
+    planifies = planning.loc[
+        planning['heure_debut'] != 'N/A',
+        ['jour_date', 'salle_nom', 'heure_debut_min',
+         'patient_nom', 'heure_debut', 'heure_fin', 'patient_duree']
+    ].sort_values(['jour_date', 'salle_nom', 'heure_debut_min'], kind='mergesort')
+    affichage = planifies[['patient_nom', 'heure_debut', 'heure_fin', 'patient_duree']]
+    
+    # Groupes contigus après tri : découpage en tranches, sans table de hachage
+    vue = {}
+    debut = 0
+    for (jour, salle), run in groupby(zip(planifies['jour_date'], planifies['salle_nom'])):
+        taille = sum(1 for _ in run)
+        vue.setdefault(jour, {})[salle] = affichage.iloc[debut:debut + taille]
+        debut += taille
+    return vue
+
+
+@st.cache_data(show_spinner=False)
+def tableau_arrow(df_final):
+    """
+    Tableau final converti une fois en table Arrow (catégories encodées en
+    dictionnaire), transmise telle quelle à st.dataframe.
+    """
+    return pa.Table.from_pandas(df_final, preserve_index=False)
+
+
+@st.cache_data(show_spinner=False)
+def exporter_csv(df_final):
+    """
+    Export CSV encodé une fois (BOM UTF-8 pour Excel), écrit directement en
+    octets dans un tampon plutôt que via une chaîne intermédiaire.
+    """
+    tampon = io.BytesIO()
+    tampon.write(b'\xef\xbb\xbf')
+    df_final.to_csv(tampon, index=False, encoding='utf-8')
+    return tampon.getvalue()
 
 # ============================================================================
 # CONFIGURATION STREAMLIT
@@ -127,12 +531,29 @@ if 'chirurgiens' not in st.session_state:
 if 'jours' not in st.session_state:
     st.session_state.jours = []
 if 'compatibilite' not in st.session_state:
-    st.session_state.compatibilite = {}
+    # Matrice uint8 patients x chirurgiens, indexée par identifiants
+    st.session_state.compatibilite = pd.DataFrame(dtype=np.uint8)
 if 'planning_final' not in st.session_state:
     st.session_state.planning_final = None
 if 'parametres_ordo' not in st.session_state:
     st.session_state.parametres_ordo = {}
 
+# Ensembles d'identifiants tenus à jour avec chaque liste : test d'unicité
+# en O(1) à l'ajout. Reconstruits dès que la liste est remplacée (import,
+# suppression, réinitialisation), repérée par l'id() de la liste source
+for cle in ('patients', 'salles', 'chirurgiens'):
+    liste = st.session_state[cle]
+    if (st.session_state.get(f'_ids_source_{cle}') != id(liste)
+            or len(st.session_state[f'_ids_{cle}']) != len(liste)):
+        st.session_state[f'_ids_{cle}'] = {e['id'] for e in liste}
+        st.session_state[f'_ids_source_{cle}'] = id(liste)
+
+
+def ajouter_element(cle, element):
+    """Ajoute un patient, une salle ou un chirurgien et son identifiant."""
+    st.session_state[cle].append(element)
+    st.session_state[f'_ids_{cle}'].add(element['id'])
+
 # ============================================================================
 # SIDEBAR - NAVIGATION
 # ============================================================================
@@ -157,16 +578,18 @@ with st.sidebar:
     st.caption("Statut des données :")
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("Patients", len(st.session_state.patients))
-        st.metric("Salles", len(st.session_state.salles))
+        st.metric("Patients", len(st.session_state._ids_patients))
+        st.metric("Salles", len(st.session_state._ids_salles))
     with col2:
-        st.metric("Chirurgiens", len(st.session_state.chirurgiens))
-        compat_count = len(st.session_state.compatibilite)
+        st.metric("Chirurgiens", len(st.session_state._ids_chirurgiens))
+        compat_count = st.session_state.compatibilite.size
         st.metric("Compatibilités", compat_count)
     
     if st.button("🔄 Réinitialiser", type="secondary", key="reset_button"):
-        for key in ['patients', 'salles', 'chirurgiens', 'jours', 'compatibilite', 'planning_final']:
-            st.session_state[key] = [] if key != 'compatibilite' else {}
+        for key in ['patients', 'salles', 'chirurgiens', 'jours']:
+            st.session_state[key] = []
+        st.session_state.compatibilite = pd.DataFrame(dtype=np.uint8)
+        st.session_state.planning_final = None
         st.rerun()
 
 # ============================================================================
@@ -208,15 +631,16 @@ if page == "🏠 Accueil":
         st.subheader("📊 Données")
         stats_data = {
             "Donnée": ["Patients", "Salles", "Chirurgiens", "Compatibilités", "Planning"],
+            # Valeurs en texte : colonne homogène (compteurs et ✅/❌)
             "Valeur": [
-                len(st.session_state.patients),
-                len(st.session_state.salles),
-                len(st.session_state.chirurgiens),
-                len(st.session_state.compatibilite),
-                "✅" if st.session_state.planning_final else "❌"
+                str(len(st.session_state.patients)),
+                str(len(st.session_state.salles)),
+                str(len(st.session_state.chirurgiens)),
+                str(st.session_state.compatibilite.size),
+                "✅" if st.session_state.planning_final is not None else "❌"
             ]
         }
-        st.table(pd.DataFrame(stats_data))
+        st.table(stats_data)
 
 # ============================================================================
 # PAGE PATIENTS
@@ -241,11 +665,10 @@ elif page == "👥 Patients":
         
         if st.form_submit_button("💾 Enregistrer", key="patient_save_button"):
             if patient_id and nom and prenom:
-                ids_existants = [p['id'] for p in st.session_state.patients]
-                if patient_id in ids_existants:
+                if patient_id in st.session_state._ids_patients:
                     st.error(f"ID {patient_id} existe déjà !")
                 else:
-                    st.session_state.patients.append({
+                    ajouter_element('patients', {
                         'id': patient_id,
                         'nom': nom,
                         'prenom': prenom,
@@ -276,11 +699,10 @@ elif page == "🚪 Salles":
         
         if st.form_submit_button("➕ Ajouter", key="salle_save_button"):
             if salle_id and nom_salle:
-                ids_existants = [s['id'] for s in st.session_state.salles]
-                if salle_id in ids_existants:
+                if salle_id in st.session_state._ids_salles:
                     st.error(f"ID {salle_id} existe déjà !")
                 else:
-                    st.session_state.salles.append({
+                    ajouter_element('salles', {
                         'id': salle_id,
                         'nom': nom_salle,
                         'capacite': capacite
@@ -310,11 +732,10 @@ elif page == "👨‍⚕️ Chirurgiens":
         
         if st.form_submit_button("👨‍⚕️ Ajouter", key="chir_save_button"):
             if chir_id and nom and prenom:
-                ids_existants = [c['id'] for c in st.session_state.chirurgiens]
-                if chir_id in ids_existants:
+                if chir_id in st.session_state._ids_chirurgiens:
                     st.error(f"ID {chir_id} existe déjà !")
                 else:
-                    st.session_state.chirurgiens.append({
+                    ajouter_element('chirurgiens', {
                         'id': chir_id,
                         'nom': nom,
                         'prenom': prenom,
@@ -338,28 +759,22 @@ elif page == "⚖️ Compatibilité":
     if not st.session_state.patients or not st.session_state.chirurgiens:
         st.warning("Ajoutez d'abord des patients et des chirurgiens")
     else:
-        # Initialisation si vide
-        if not st.session_state.compatibilite:
-            for patient in st.session_state.patients:
-                for chirurgien in st.session_state.chirurgiens:
-                    cle = (patient['id'], chirurgien['id'])
-                    st.session_state.compatibilite[cle] = 1
+        # Alignement sur les patients/chirurgiens actuels (nouveaux : compatibles)
+        ids_patients = [p['id'] for p in st.session_state.patients]
+        ids_chirurgiens = [c['id'] for c in st.session_state.chirurgiens]
+        st.session_state.compatibilite = st.session_state.compatibilite.reindex(
+            index=ids_patients, columns=ids_chirurgiens, fill_value=1
+        ).astype(np.uint8)
         
         # Interface pour modifier les compatibilités
         st.subheader("Matrice de compatibilité")
         st.write("Cocher = Compatible (1), Décocher = Non compatible (0)")
         
-        # Créer un DataFrame pour l'éditeur
-        compat_data = []
-        for patient in st.session_state.patients:
-            row = {'Patient': f"{patient['id']} - {patient['prenom']} {patient['nom']}"}
-            for chirurgien in st.session_state.chirurgiens:
-                cle = (patient['id'], chirurgien['id'])
-                valeur = st.session_state.compatibilite.get(cle, 1)
-                row[chirurgien['id']] = bool(valeur)
-            compat_data.append(row)
-        
-        df_compat = pd.DataFrame(compat_data)
+        # DataFrame de l'éditeur : vue booléenne de la matrice
+        df_compat = st.session_state.compatibilite.astype(bool).reset_index(drop=True)
+        df_compat.insert(0, 'Patient', [
+            f"{p['id']} - {p['prenom']} {p['nom']}" for p in st.session_state.patients
+        ])
         
         # Éditeur interactif
         edited_df = st.data_editor(
@@ -379,18 +794,19 @@ elif page == "⚖️ Compatibilité":
         
         # Sauvegarder les modifications
         if st.button("💾 Enregistrer les compatibilités", key="compat_save_button"):
-            for idx, row in edited_df.iterrows():
-                patient_id = row['Patient'].split(" - ")[0]
-                for chirurgien in st.session_state.chirurgiens:
-                    chir_id = chirurgien['id']
-                    cle = (patient_id, chir_id)
-                    st.session_state.compatibilite[cle] = int(row[chir_id])
+            # Aller-retour vectorisé : identifiants relus depuis la colonne
+            # Patient, bloc de cases converti en uint8 d'un seul cast
+            ids_edites = edited_df['Patient'].str.split(' - ', n=1).str[0]
+            st.session_state.compatibilite = (
+                edited_df.drop(columns='Patient').set_index(ids_edites)
+                .rename_axis(None).astype(np.uint8)
+            )
             st.success("Compatibilités enregistrées !")
         
         # Statistiques
         st.subheader("📊 Statistiques de compatibilité")
-        total_compat = len(st.session_state.compatibilite)
-        compat_oui = sum(1 for v in st.session_state.compatibilite.values() if v == 1)
+        total_compat = st.session_state.compatibilite.size
+        compat_oui = int(st.session_state.compatibilite.to_numpy().sum())
         compat_non = total_compat - compat_oui
         
         col1, col2, col3 = st.columns(3)
@@ -417,15 +833,16 @@ elif page == "📅 Configuration":
         date_debut = st.date_input("Date de début", datetime.now(), key="date_debut_input")
         
         if st.button("📅 Générer les jours", key="generate_days_button"):
-            st.session_state.jours = []
+            jours = []
             for i in range(nb_jours):
                 date_jour = date_debut + timedelta(days=i)
-                st.session_state.jours.append({
+                jours.append({
                     'numero': i + 1,
                     'date': date_jour.strftime("%Y-%m-%d"),
                     'jour_semaine': date_jour.strftime("%A"),
                     'label': f"Jour {i+1} ({date_jour.strftime('%d/%m/%Y')})"
                 })
+            st.session_state.jours = jours
             st.success(f"{nb_jours} jours générés")
     
     with col2:
@@ -439,8 +856,8 @@ elif page == "📅 Configuration":
         else:
             st.info("Aucun jour configuré")
         
-        if st.session_state.compatibilite:
-            st.write(f"**Compatibilités :** {len(st.session_state.compatibilite)} paires")
+        if not st.session_state.compatibilite.empty:
+            st.write(f"**Compatibilités :** {st.session_state.compatibilite.size} paires")
 
 # ============================================================================
 # PAGE OPTIMISATION (MODÈLE + ORDONNANCEMENT INTÉGRÉ)
@@ -471,12 +888,12 @@ elif page == "🔧 Optimisation":
         with col1:
             heure_debut = st.time_input(
                 "Heure de début",
-                value=datetime.strptime("08:00", "%H:%M").time(),
+                value=HEURE_DEBUT_DEFAUT,
                 key="heure_debut_input"
             )
             heure_fin = st.time_input(
                 "Heure de fin",
-                value=datetime.strptime("18:00", "%H:%M").time(),
+                value=HEURE_FIN_DEFAUT,
                 key="heure_fin_input"
             )
         
@@ -501,142 +918,44 @@ elif page == "🔧 Optimisation":
         with st.spinner("Optimisation en cours (modèle + ordonnancement)..."):
             try:
                 # ============================================================
-                # ÉTAPE 1 : MODÈLE MATHÉMATIQUE
+                # ÉTAPE 1 : MODÈLE MATHÉMATIQUE + RÉSULTATS (mis en cache)
                 # ============================================================
-                
-                # Préparation des données pour le modèle
-                I = [p['id'] for p in st.session_state.patients]
-                J = [s['id'] for s in st.session_state.salles]
-                S = [c['id'] for c in st.session_state.chirurgiens]
-                K = [j['numero'] for j in st.session_state.jours]
-                
-                # Durées patients
-                t = {p['id']: p['duree'] for p in st.session_state.patients}
-                
-                # Capacités salles
-                b = {(j_id, k): next(s['capacite'] for s in st.session_state.salles if s['id'] == j_id)
-                     for j_id in J for k in K}
-                
-                # Disponibilités chirurgiens
-                a = {(s_id, k): next(c['disponibilite'] for c in st.session_state.chirurgiens if c['id'] == s_id)
-                     for s_id in S for k in K}
-                
-                # MATRICE DE COMPATIBILITÉ (m)
-                m = {}
-                for patient in st.session_state.patients:
-                    for chirurgien in st.session_state.chirurgiens:
-                        cle = (patient['id'], chirurgien['id'])
-                        m[cle] = st.session_state.compatibilite.get(cle, 1)
-                
-                # Création du modèle MILP
-                prob = pulp.LpProblem("Planning_Clinique", pulp.LpMinimize)
-                
-                # Variables
-                x = pulp.LpVariable.dicts('x', (I, J, K), cat='Binary')
-                y = pulp.LpVariable.dicts('y', (I, J, S, K), cat='Binary')
-                
-                # Objectif : minimiser temps libre
-                prob += pulp.lpSum(
-                    b[(j, k)] - pulp.lpSum(t[i] * x[i][j][k] for i in I)
-                    for j in J for k in K
+                donnees_modele = (
+                    st.session_state.patients,
+                    st.session_state.salles,
+                    st.session_state.chirurgiens,
+                    st.session_state.jours,
+                    st.session_state.compatibilite
                 )
+                resultat_milp = resoudre_milp(empreinte_donnees(*donnees_modele), *donnees_modele)
+                planning_details = resultat_milp['details']
                 
-                # Contraintes
-                for i in I:
-                    prob += pulp.lpSum(x[i][j][k] for j in J for k in K) <= 1, f"Once_{i}"
-                
-                for j in J:
-                    for k in K:
-                        prob += pulp.lpSum(t[i] * x[i][j][k] for i in I) <= b[(j, k)], f"ORcap_{j}_{k}"
+                # Conversion des heures en texte, une seule fois
+                heure_debut_txt = heure_debut.strftime("%H:%M")
+                heure_fin_txt = heure_fin.strftime("%H:%M")
                 
-                for s in S:
-                    for k in K:
-                        prob += pulp.lpSum(t[i] * y[i][j][s][k] for i in I for j in J) <= a[(s, k)], f"SurgeonCap_{s}_{k}"
-                
-                # CONTRAINTE DE COMPATIBILITÉ
-                for i in I:
-                    for j in J:
-                        for s in S:
-                            for k in K:
-                                prob += y[i][j][s][k] <= m.get((i, s), 0), f"Compat_{i}_{j}_{s}_{k}"
-                
-                for i in I:
-                    for j in J:
-                        for k in K:
-                            prob += pulp.lpSum(y[i][j][s][k] for s in S) == x[i][j][k], f"Link_x_y_{i}_{j}_{k}"
-                
-                # Résolution
-                solver = pulp.PULP_CBC_CMD(msg=False, timeLimit=60)
-                prob.solve(solver)
-                
-                # ============================================================
-                # ÉTAPE 2 : RÉCUPÉRATION RÉSULTATS MODÈLE
                 # ============================================================
-                planning_details = []
-                
-                for i in I:
-                    scheduled = False
-                    for j in J:
-                        for k in K:
-                            if pulp.value(x[i][j][k]) > 0.5:
-                                scheduled = True
-                                surgeons = [s for s in S if pulp.value(y[i][j][s][k]) > 0.5]
-                                
-                                # Infos patient
-                                patient_info = next(p for p in st.session_state.patients if p['id'] == i)
-                                salle_info = next(s for s in st.session_state.salles if s['id'] == j)
-                                jour_info = next(d for d in st.session_state.jours if d['numero'] == k)
-                                
-                                planning_details.append({
-                                    'patient_id': i,
-                                    'patient_nom': f"{patient_info['nom']} {patient_info['prenom']}",
-                                    'patient_duree': patient_info['duree'],
-                                    'priorite': patient_info.get('priorite', 3),
-                                    'salle_id': j,
-                                    'salle_nom': salle_info['nom'],
-                                    'jour_numero': k,
-                                    'jour_date': jour_info['date'],
-                                    'chirurgiens': ', '.join(surgeons),
-                                    'statut': 'Planifié'
-                                })
-                    
-                    if not scheduled:
-                        patient_info = next(p for p in st.session_state.patients if p['id'] == i)
-                        planning_details.append({
-                            'patient_id': i,
-                            'patient_nom': f"{patient_info['nom']} {patient_info['prenom']}",
-                            'patient_duree': patient_info['duree'],
-                            'priorite': patient_info.get('priorite', 3),
-                            'salle_id': '',
-                            'salle_nom': '',
-                            'jour_numero': '',
-                            'jour_date': '',
-                            'chirurgiens': '',
-                            'statut': 'Non planifié'
-                        })
-                
-                # ============================================================
-                # ÉTAPE 3 : ORDONNANCEMENT HORAIRE (POST-TRAITEMENT)
+                # ÉTAPE 2 : ORDONNANCEMENT HORAIRE (POST-TRAITEMENT)
                 # ============================================================
                 planning_avec_heures = appliquer_ordonnancement_horaire(
                     planning_details,
-                    heure_debut=heure_debut.strftime("%H:%M"),
-                    heure_fin=heure_fin.strftime("%H:%M"),
+                    heure_debut=heure_debut_txt,
+                    heure_fin=heure_fin_txt,
                     pause=pause,
                     regle_ordre=regle[0]
                 )
                 
                 # ============================================================
-                # ÉTAPE 4 : SAUVEGARDE FINALE
+                # ÉTAPE 3 : SAUVEGARDE FINALE
                 # ============================================================
                 st.session_state.planning_final = planning_avec_heures
                 st.session_state.parametres_ordo = {
                     'regle': regle[1],
-                    'heure_debut': heure_debut.strftime("%H:%M"),
-                    'heure_fin': heure_fin.strftime("%H:%M"),
+                    'heure_debut': heure_debut_txt,
+                    'heure_fin': heure_fin_txt,
                     'pause': pause,
-                    'modele_statut': pulp.LpStatus[prob.status],
-                    'modele_objectif': pulp.value(prob.objective),
+                    'modele_statut': resultat_milp['statut'],
+                    'modele_objectif': resultat_milp['objectif'],
                     'compatibilite_utilisee': True
                 }
                 
@@ -656,7 +975,11 @@ elif page == "🔧 Optimisation":
 elif page == "📋 Planning Final":
     st.header("📋 Planning Chirurgical Complet")
     
-    if not st.session_state.planning_final:
+    # Lu une seule fois depuis session_state pour toute la page
+    planning = st.session_state.planning_final
+    params = st.session_state.parametres_ordo
+    
+    if planning is None or planning.empty:
         st.warning("""
         ⚠️ Aucun planning disponible.
         
@@ -672,9 +995,7 @@ elif page == "📋 Planning Final":
             st.rerun()
     else:
         # Afficher les paramètres utilisés
-        if st.session_state.parametres_ordo:
-            params = st.session_state.parametres_ordo
-            
+        if params:
             col1, col2, col3, col4 = st.columns(4)
             with col1:
                 st.metric("Règle", params.get('regle', 'LPT'))
@@ -685,46 +1006,8 @@ elif page == "📋 Planning Final":
             with col4:
                 st.metric("Statut modèle", params.get('modele_statut', 'N/A'))
         
-        # Créer le DataFrame final
-        planning_data = []
-        
-        for rdv in st.session_state.planning_final:
-            if rdv.get('heure_debut') != 'N/A':
-                planning_data.append({
-                    'Patient': rdv.get('patient_nom', ''),
-                    'Durée (min)': rdv.get('patient_duree', 0),
-                    'Priorité': rdv.get('priorite', 'N/A'),
-                    'Salle': rdv.get('salle_nom', ''),
-                    'Date': rdv.get('jour_date', ''),
-                    'Début': rdv.get('heure_debut', ''),
-                    'Fin': rdv.get('heure_fin', ''),
-                    'Chirurgien(s)': rdv.get('chirurgiens', ''),
-                    'Statut': '✅ Planifié'
-                })
-            else:
-                planning_data.append({
-                    'Patient': rdv.get('patient_nom', ''),
-                    'Durée (min)': rdv.get('patient_duree', 0),
-                    'Priorité': rdv.get('priorite', 'N/A'),
-                    'Salle': 'N/A',
-                    'Date': 'N/A',
-                    'Début': 'N/A',
-                    'Fin': 'N/A',
-                    'Chirurgien(s)': 'N/A',
-                    'Statut': '❌ ' + rdv.get('statut', 'Non planifié')
-                })
-        
-        df_final = pd.DataFrame(planning_data)
-        
-        # Trier par date puis heure
-        if 'Début' in df_final.columns:
-            df_final['tri_date'] = pd.to_datetime(df_final['Date'])
-            df_final['tri_heure'] = df_final['Début'].apply(
-                lambda x: int(x.split(':')[0])*60 + int(x.split(':')[1]) 
-                if ':' in str(x) else 9999
-            )
-            df_final = df_final.sort_values(['tri_date', 'tri_heure'])
-            df_final = df_final.drop(['tri_date', 'tri_heure'], axis=1)
+        # DataFrame final et export CSV (mis en cache sur le planning)
+        df_final = construire_tableau_final(planning)
         
         # AFFICHAGE PRINCIPAL
         st.subheader("Planning horaire complet")
@@ -735,7 +1018,7 @@ elif page == "📋 Planning Final":
         with tab1:
             # Tableau principal
             st.dataframe(
-                df_final,
+                tableau_arrow(df_final),
                 column_config={
                     "Début": st.column_config.TextColumn("Heure début", width="small"),
                     "Fin": st.column_config.TextColumn("Heure fin", width="small"),
@@ -750,7 +1033,7 @@ elif page == "📋 Planning Final":
             )
             
             # Export
-            csv_data = df_final.to_csv(index=False, encoding='utf-8-sig')
+            csv_data = exporter_csv(df_final)
             st.download_button(
                 "📥 Télécharger CSV",
                 csv_data,
@@ -760,11 +1043,9 @@ elif page == "📋 Planning Final":
             )
         
         with tab2:
-            # Vue par jour
-            jours_planifies = sorted(set(
-                rdv['jour_date'] for rdv in st.session_state.planning_final 
-                if rdv.get('heure_debut') != 'N/A'
-            ))
+            # Vue par jour (regroupement jour/salle mis en cache)
+            vue_par_jour = grouper_vue_par_jour(planning)
+            jours_planifies = list(vue_par_jour)
             
             if jours_planifies:
                 jour_selectionne = st.selectbox(
@@ -773,39 +1054,32 @@ elif page == "📋 Planning Final":
                     key="select_jour_vue_jour"
                 )
                 
-                # Filtrer pour ce jour
-                rdvs_jour = [
-                    rdv for rdv in st.session_state.planning_final
-                    if rdv.get('jour_date') == jour_selectionne and rdv.get('heure_debut') != 'N/A'
-                ]
+                # Une seule recherche : salles du jour, déjà triées par heure
+                rdvs_par_salle = vue_par_jour.get(jour_selectionne, {})
                 
-                if rdvs_jour:
+                if rdvs_par_salle:
                     # Afficher par salle
-                    for salle in sorted(set(r['salle_nom'] for r in rdvs_jour)):
+                    for salle, rdvs_salle in rdvs_par_salle.items():
                         with st.expander(f"🚪 {salle}", expanded=True):
-                            rdvs_salle = [
-                                r for r in rdvs_jour 
-                                if r['salle_nom'] == salle
-                            ]
-                            rdvs_salle.sort(key=lambda x: x.get('heure_debut_min', 0))
+                            # Barres de progression calculées en bloc (10h = 600 min)
+                            duree_max = 600
+                            progressions = np.minimum(rdvs_salle['patient_duree'].to_numpy() / duree_max, 1.0)
                             
-                            for rdv in rdvs_salle:
+                            for (nom, debut, fin, duree), progression in zip(
+                                rdvs_salle.itertuples(index=False, name=None), progressions
+                            ):
                                 col1, col2, col3 = st.columns([4, 3, 3])
                                 with col1:
-                                    st.write(f"**{rdv['patient_nom']}**")
+                                    st.write(f"**{nom}**")
                                 with col2:
-                                    st.write(f"🕒 {rdv['heure_debut']} - {rdv['heure_fin']}")
+                                    st.write(f"🕒 {debut} - {fin}")
                                 with col3:
-                                    st.write(f"⏱️ {rdv['patient_duree']} min")
+                                    st.write(f"⏱️ {duree} min")
                                 
                                 # Barre de progression pour visualisation
-                                duree = rdv['patient_duree']
-                                duree_max = 600  # 10h en minutes
-                                progression = min(duree / duree_max, 1.0)
-                                
                                 st.progress(
-                                    progression,
-                                    text=f"{rdv['heure_debut']} → {rdv['heure_fin']} ({duree} min)"
+                                    float(progression),
+                                    text=f"{debut} → {fin} ({duree} min)"
                                 )
                 else:
                     st.info(f"Aucune intervention le {jour_selectionne}")
@@ -814,6 +1088,26 @@ elif page == "📋 Planning Final":
             # Statistiques
             st.subheader("📊 Statistiques du planning")
             
-            # Calcul des statistiques
-            total_patients = len(st.session_state.planning_final)
-            patients_planifies = sum(1 for r in st.session_state.planning_final)
+            # Calcul des statistiques : un filtre puis une seule agrégation par
+            # salle (nombre et durée), dont se déduisent les totaux
+            planifies_final = df_final[df_final['Début'] != 'N/A']
+            par_salle = planifies_final.groupby('Salle', observed=True, sort=False)['Durée (min)'].agg(['size', 'sum'])
+            total_patients = df_final.shape[0]
+            patients_planifies = int(par_salle['size'].sum())
+            duree_totale = int(par_salle['sum'].sum())
+            
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Patients", total_patients)
+            with col2:
+                st.metric("Planifiés", patients_planifies)
+            with col3:
+                st.metric("Non planifiés", total_patients - patients_planifies)
+            with col4:
+                taux = (patients_planifies / total_patients * 100) if total_patients > 0 else 0
+                st.metric("Taux de planification", f"{taux:.1f}%")
+            
+            # Temps opératoire par salle
+            st.subheader("Temps opératoire par salle")
+            st.caption(f"Durée totale planifiée : {duree_totale} min")
+            st.bar_chart(par_salle['sum'].rename('Durée (min)'))